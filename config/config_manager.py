@@ -1,8 +1,25 @@
+import os
 import configparser
+import json
 from pathlib import Path
 from typing import List
 from servatio.core.backup_task import BackupTask
 
+try:
+    import orjson  # необязательная зависимость, заметно быстрее json
+except ImportError:
+    orjson = None
+
+def _dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+def _loads(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode('utf-8'))
+
 class ConfigManager:
     def __init__(self, config_path: Path):
         self.config_path = config_path
@@ -10,11 +27,26 @@ class ConfigManager:
 
     def load(self) -> List[BackupTask]:
         if not self.config_path.exists():
+            legacy_path = self.config_path.with_suffix(".ini")
+            if legacy_path.exists():
+                return self._migrate_ini(legacy_path)
+            return []
+
+        try:
+            data = _loads(self.config_path.read_bytes())
+            log_dir_str = data.get("log_dir")
+            if log_dir_str:
+                self.log_dir = Path(log_dir_str)
+            return [BackupTask.from_dict(task) for task in data.get("tasks", [])]
+        except Exception as e:
+            print(f"Ошибка загрузки конфига: {e}")
             return []
 
+    def _migrate_ini(self, legacy_path: Path) -> List[BackupTask]:
+        # Однократный перенос старого servatio_config.ini в JSON
         config = configparser.ConfigParser()
         try:
-            config.read(self.config_path, encoding='utf-8')
+            config.read(legacy_path, encoding='utf-8')
             if "global" in config:
                 log_dir_str = config["global"].get("log_dir")
                 if log_dir_str:
@@ -25,18 +57,21 @@ class ConfigManager:
                 task = BackupTask.from_dict(config[f"task_{i}"])
                 tasks.append(task)
                 i += 1
-            return tasks
         except Exception as e:
             print(f"Ошибка загрузки конфига: {e}")
             return []
+        self.save(tasks)
+        return tasks
 
     def save(self, tasks: List[BackupTask]):
         self.log_dir.mkdir(parents=True, exist_ok=True)
+        self.config_path.parent.mkdir(parents=True, exist_ok=True)
 
-        config = configparser.ConfigParser()
-        config["global"] = {"log_dir": str(self.log_dir)}
-        for i, task in enumerate(tasks):
-            config[f"task_{i}"] = task.to_dict()
-
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            config.write(f)
\ No newline at end of file
+        data = {
+            "log_dir": str(self.log_dir),
+            "tasks": [task.to_dict() for task in tasks]
+        }
+        # Запись во временный файл и атомарная замена: сбой посреди записи не портит конфиг
+        tmp_path = self.config_path.with_name(self.config_path.name + ".tmp")
+        tmp_path.write_bytes(_dumps(data))
+        os.replace(tmp_path, self.config_path)
@@ -1,36 +1,76 @@
 from typing import List
 from pathlib import Path
 import json
+from servatio.utils.helpers import compile_excludes
 
 # === Стандартные исключения ===
 DEFAULT_EXCLUDE_PATTERNS = [
     "*.tmp", "*.log", ".git", ".gitignore", "__pycache__", "*.pyc",
     ".DS_Store", "Thumbs.db", "desktop.ini", "$RECYCLE.BIN", "System Volume Information"
 ]
+# Число потоков копирования по умолчанию
+DEFAULT_COPY_WORKERS = 4
 
 class BackupTask:
-    def __init__(self, name: str, source: str, destination: str, exclude_patterns: List[str] = None, delete_extra: bool = True):
+    def __init__(self, name: str, source: str, destination: str, exclude_patterns: List[str] = None, delete_extra: bool = True,
+                 fast_dir_skip: bool = False, snapshot_mode: bool = False,
+                 max_workers: int = DEFAULT_COPY_WORKERS, use_index: bool = False, last_source_bytes: int = 0,
+                 last_sync_ns: int = 0):
         self.name = name
         self.source = Path(source)
         self.destination = Path(destination)
         self.exclude_patterns = exclude_patterns or DEFAULT_EXCLUDE_PATTERNS.copy()
         self.delete_extra = delete_extra
+        self.fast_dir_skip = fast_dir_skip
+        self.snapshot_mode = snapshot_mode
+        self.max_workers = max_workers
+        self.use_index = use_index
+        # Размер источника по итогам последнего запуска — для грубой проверки места до обхода
+        self.last_source_bytes = last_source_bytes
+        # Начало последнего успешного прогона (нс) — для пропуска неизменённых файлов
+        self.last_sync_ns = last_sync_ns
+
+    @property
+    def excludes(self):
+        # Скомпилированный предикат исключений; компиляция кэшируется по списку шаблонов
+        return compile_excludes(self.exclude_patterns)
 
     def to_dict(self):
         return {
             "name": self.name,
             "source": str(self.source),
             "destination": str(self.destination),
-            "exclude_patterns": json.dumps(self.exclude_patterns),
-            "delete_extra": str(self.delete_extra)
+            "exclude_patterns": list(self.exclude_patterns),
+            "delete_extra": self.delete_extra,
+            "fast_dir_skip": self.fast_dir_skip,
+            "snapshot_mode": self.snapshot_mode,
+            "max_workers": self.max_workers,
+            "use_index": self.use_index,
+            "last_source_bytes": self.last_source_bytes,
+            "last_sync_ns": self.last_sync_ns
         }
 
     @classmethod
     def from_dict(cls, data):
+        # Принимает и JSON-словарь, и секцию старого INI-конфига (всё строками)
+        exclude_patterns = data.get("exclude_patterns", [])
+        if isinstance(exclude_patterns, str):
+            exclude_patterns = json.loads(exclude_patterns)
         return cls(
             name=data["name"],
             source=data["source"],
             destination=data["destination"],
-            exclude_patterns=json.loads(data.get("exclude_patterns", "[]")),
-            delete_extra=data.get("delete_extra", "True").lower() == "true"
-        )
\ No newline at end of file
+            exclude_patterns=exclude_patterns,
+            delete_extra=_as_bool(data.get("delete_extra", True)),
+            fast_dir_skip=_as_bool(data.get("fast_dir_skip", False)),
+            snapshot_mode=_as_bool(data.get("snapshot_mode", False)),
+            max_workers=int(data.get("max_workers", DEFAULT_COPY_WORKERS)),
+            use_index=_as_bool(data.get("use_index", False)),
+            last_source_bytes=int(data.get("last_source_bytes", 0)),
+            last_sync_ns=int(data.get("last_sync_ns", 0))
+        )
+
+def _as_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() == "true"
\ No newline at end of file
@@ -1,75 +1,316 @@
 import os
+import re
 import shutil
-from pathlib import Path
-from servatio.utils.helpers import is_excluded, files_are_equal, validate_paths, get_total_files
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from servatio.utils.fastcopy import fast_copy2
+from servatio.utils.helpers import files_are_equal, get_free_space
 from servatio.utils.metrics import BackupMetrics
+from servatio.core.backup_task import DEFAULT_COPY_WORKERS
 import logging
 
 logger = logging.getLogger("Servatio")
 
-def sync_recursive(task, metrics: BackupMetrics, log_callback, update_progress, should_delete=True):
-    src = task.source
-    dst = task.destination
-    exclude_patterns = task.exclude_patterns
+# Сколько операций копирования может стоять в очереди на каждый поток
+COPY_QUEUE_PER_WORKER = 16
+# Режим снимков: каждый запуск — новая папка, неизменённые файлы — жёсткие ссылки на прошлый снимок
+SNAPSHOT_NAME_FORMAT = "%Y-%m-%d_%H%M%S"
+SNAPSHOT_NAME_RE = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{6}$")
 
-    if not src.exists():
-        log_callback(f"❌ Исходный каталог не существует: {src}")
+def sync_tree(task, metrics: BackupMetrics, log_callback, update_progress, should_delete=True,
+              max_workers=None, excludes=None, on_scan_progress=None, on_low_space=None,
+              index=None):
+    # Внутри обхода пути — обычные строки: без создания Path на каждый файл
+    root_src = str(task.source)
+    root_dst = str(task.destination)
+    if excludes is None:
+        excludes = task.excludes
+    if max_workers is None:
+        max_workers = max(1, task.max_workers or DEFAULT_COPY_WORKERS)
+
+    if not os.path.exists(root_src):
+        log_callback(f"❌ Исходный каталог не существует: {root_src}")
         return
 
-    dst.mkdir(parents=True, exist_ok=True)
+    # Назначение внутри источника: не даём обходу спускаться в собственную копию,
+    # иначе каждый запуск заново копирует уже скопированное дерево в него же
+    nested_dst = _nested_rel_path(root_src, root_dst)
+    if nested_dst is not None:
+        log_callback(f"⚠️ Назначение находится внутри источника, папка {root_dst} пропускается")
+        source_excludes = excludes
+        def excludes(rel_path):
+            return os.path.normcase(rel_path) == nested_dst or source_excludes(rel_path)
 
-    try:
-        src_items = {p.name: p for p in src.iterdir() if not is_excluded(p, exclude_patterns, src)}
-        dst_items = {p.name: p for p in dst.iterdir()}
-    except PermissionError as e:
-        log_callback(f"⚠️ Нет доступа к {src} или {dst}: {e}")
-        return
-    except OSError as e:
-        log_callback(f"⚠️ Ошибка доступа к файлам в {src} или {dst}: {e}")
-        return
+    root_prev = None
+    if task.snapshot_mode:
+        root_prev = find_latest_snapshot(root_dst)
+        root_dst = os.path.join(root_dst, datetime.now().strftime(SNAPSHOT_NAME_FORMAT))
+        if root_prev:
+            log_callback(f"Новый снимок: {root_dst} (неизменённые файлы — ссылки на {root_prev})")
+        else:
+            log_callback(f"Новый снимок: {root_dst}")
+
+    run_started_ns = time.time_ns()
+    walk_complete = False
+    # Обход дерева и создание каталогов идут в текущем потоке,
+    # копирование файлов — в пуле потоков
+    slots = threading.BoundedSemaphore(max_workers * COPY_QUEUE_PER_WORKER)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="servatio-copy") as executor:
+        def on_copy_done(future):
+            slots.release()
+            error = future.exception()
+            if error is not None:
+                log_callback(f"⚠️ Ошибка в потоке копирования: {error}")
+                metrics.add_error()
+
+        def submit(fn, *args):
+            slots.acquire()
+            future = executor.submit(fn, *args, log_callback, update_progress, metrics)
+            future.add_done_callback(on_copy_done)
+
+        # Быстрый пропуск возможен только без удаления лишних: иначе нужен полный листинг назначения.
+        # Время последней синхронизации — начало того прогона по часам этой машины, а не mtime
+        # каталога назначения: тот меняется, когда пул дописывает файлы, и идёт по часам сервера
+        synced_ns = task.last_sync_ns if task.fast_dir_skip and not should_delete else 0
+        remove = safe_remove
+        name_only = getattr(excludes, "name_only", False)
+        join = os.path.join
+        # Место проверяется по ходу обхода, без отдельного подсчёта размера источника.
+        # Свободное место запрашивается один раз за запуск
+        bytes_planned = 0
+        free_space = None
+        if on_low_space and task.last_source_bytes:
+            # Места заведомо хватает (вдвое больше всего источника в прошлый раз) —
+            # не считаем размеры по ходу обхода
+            free_space = get_free_space(root_dst)
+            if free_space > 2 * task.last_source_bytes:
+                on_low_space = None
+        # Индекс: файлы, чей источник не менялся с последней сверки, не сверяются с назначением.
+        # В снимках назначение всегда новое — индекс там не нужен
+        index_rows = None
+        if index is not None and not task.snapshot_mode:
+            try:
+                index_rows = index.load(root_src, root_dst)
+            except Exception as e:
+                # Индекс — только кэш: без него файлы просто сверяются с назначением
+                log_callback(f"⚠️ Не удалось прочитать индекс файлов, сверка без него: {e}")
+        verified = {}
+
+        # Явный стек вместо рекурсии: глубина дерева не ограничена лимитом рекурсии Python
+        stack = [(root_src, root_dst, "", root_prev)]
+        while stack:
+            src, dst, rel_prefix, prev = stack.pop()
+            try:
+                # Только что созданный каталог пуст: листинг назначения и удаление лишнего не нужны
+                try:
+                    os.makedirs(dst)
+                    freshly_created = True
+                except FileExistsError:
+                    freshly_created = False
+                # Каталог источника не менялся после последней синхронизации: уже скопированные файлы
+                # не сверяем, недостающие докопируем. Подкаталоги обходим всё равно — их mtime независим.
+                # Правка файла на месте не меняет mtime каталога, поэтому файлы новее
+                # последней синхронизации сверяются всё равно
+                dir_unchanged = (synced_ns and not freshly_created
+                                 and os.stat(src).st_mtime_ns <= synced_ns)
+                # Исключённые элементы отбрасываются по имени, до спуска в каталог.
+                # DirEntry кэширует тип и stat, поэтому повторных системных вызовов нет
+                with os.scandir(src) as it:
+                    if name_only:
+                        src_items = {e.name: e for e in it if not excludes(e.name)}
+                    else:
+                        src_items = {e.name: e for e in it if not excludes(rel_prefix + e.name)}
+                if freshly_created:
+                    dst_items = {}
+                else:
+                    with os.scandir(dst) as it:
+                        dst_items = {e.name: e for e in it}
+            except PermissionError as e:
+                log_callback(f"⚠️ Нет доступа к {src} или {dst}: {e}")
+                continue
+            except OSError as e:
+                log_callback(f"⚠️ Ошибка доступа к файлам в {src} или {dst}: {e}")
+                continue
+            prev_items = {}
+            if prev is not None:
+                try:
+                    with os.scandir(prev) as it:
+                        prev_items = {e.name: e for e in it}
+                except OSError:
+                    pass
+
+            # Каждый элемент классифицируется один раз. Число и объём файлов считаются прямо
+            # во время обхода, без отдельного прохода; stat() DirEntry потом переиспользуется при сверке.
+            # Сбой на одном элементе (битая или зацикленная ссылка, файл исчез во время обхода)
+            # не должен прерывать задачу: пишем ошибку и идём дальше
+            kinds = {}
+            for name, src_entry in src_items.items():
+                try:
+                    # Ссылки на каталоги не обходим: без проверки циклов ссылка на предка
+                    # копировалась бы в саму себя до ELOOP. Ссылки на файлы копируются содержимым
+                    if src_entry.is_dir(follow_symlinks=False):
+                        kinds[name] = True
+                    elif src_entry.is_symlink() and src_entry.is_dir():
+                        log_callback(f"⚠️ Ссылка на каталог пропущена: {src_entry.path}")
+                    else:
+                        metrics.total_bytes += src_entry.stat().st_size
+                        metrics.total_files += 1
+                        kinds[name] = False
+                except OSError as e:
+                    log_callback(f"⚠️ Ошибка чтения {src_entry.path}: {e}")
+                    metrics.add_error()
+            if on_scan_progress:
+                on_scan_progress(metrics.total_files, False)
+
+            # Сначала файлы текущего каталога, затем подкаталоги
+            subdirs = []
+            copies = []
+            links = []
+            for name, is_dir in kinds.items():
+                src_entry = src_items[name]
+                try:
+                    dst_path = join(dst, name)
+                    existing_dst = dst_items.get(name)
+                    if is_dir:
+                        if existing_dst is not None and not existing_dst.is_dir(follow_symlinks=False):
+                            remove(existing_dst.path, log_callback, metrics)
+                        prev_entry = prev_items.get(name)
+                        prev_dir = prev_entry.path if prev_entry is not None and prev_entry.is_dir(follow_symlinks=False) else None
+                        subdirs.append((src_entry.path, dst_path, f"{rel_prefix}{name}/", prev_dir))
+                    elif existing_dst is None:
+                        prev_entry = prev_items.get(name)
+                        if (prev_entry is not None and prev_entry.is_file(follow_symlinks=False)
+                                and files_are_equal(src_entry.stat(), prev_entry.stat(follow_symlinks=False))):
+                            links.append((src_entry.path, prev_entry.path, dst_path))
+                        else:
+                            copies.append((src_entry, dst_path))
+                    elif dir_unchanged and src_entry.stat().st_mtime_ns <= synced_ns:
+                        if index_rows is not None and f"{rel_prefix}{name}" in index_rows:
+                            verified[f"{rel_prefix}{name}"] = index_rows[f"{rel_prefix}{name}"]
+                        update_progress(src_entry.path)
+                    elif existing_dst.is_file(follow_symlinks=False):
+                        # stat() у DirEntry кэшируется (а на Windows берётся прямо из листинга каталога)
+                        src_stat = src_entry.stat()
+                        if index_rows is not None:
+                            rel = f"{rel_prefix}{name}"
+                            state = (src_stat.st_size, src_stat.st_mtime_ns)
+                            if index_rows.get(rel) == state:
+                                verified[rel] = state
+                                update_progress(src_entry.path)
+                                continue
+                        if files_are_equal(src_stat, existing_dst.stat(follow_symlinks=False)):
+                            if index_rows is not None:
+                                verified[rel] = state
+                            update_progress(src_entry.path)
+                        else:
+                            copies.append((src_entry, dst_path))
+                    else:
+                        remove(existing_dst.path, log_callback, metrics)
+                        copies.append((src_entry, dst_path))
+                except OSError as e:
+                    log_callback(f"⚠️ Ошибка чтения {src_entry.path}: {e}")
+                    metrics.add_error()
+
+            if on_low_space and copies:
+                bytes_planned += sum(_entry_size(src_entry) for src_entry, _ in copies)
+                if free_space is None:
+                    free_space = get_free_space(root_dst)
+                if bytes_planned > free_space:
+                    if not on_low_space(bytes_planned, free_space):
+                        log_callback("❌ Задача остановлена: недостаточно места в назначении")
+                        break
+                    # Пользователь согласился продолжить — больше не спрашиваем
+                    on_low_space = None
+            for src_entry, dst_path in copies:
+                submit(safe_copy, src_entry.path, dst_path)
+            for src_path, prev_path, dst_path in links:
+                submit(safe_link, src_path, prev_path, dst_path)
+
+            if should_delete and not freshly_created:
+                for name, dst_entry in dst_items.items():
+                    if name not in src_items:
+                        remove(dst_entry.path, log_callback, metrics)
 
-    for name, src_path in src_items.items():
-        dst_path = dst / name
-        if name not in dst_items:
-            safe_copy(src_path, dst_path, log_callback, update_progress, metrics)
+            # В обратном порядке, чтобы подкаталоги обходились в порядке листинга
+            stack.extend(reversed(subdirs))
         else:
-            existing_dst = dst_items[name]
-            if src_path.is_dir() and existing_dst.is_dir():
-                sync_recursive(task, metrics, log_callback, update_progress, should_delete)
-            elif src_path.is_file() and existing_dst.is_file():
-                if not files_are_equal(src_path, existing_dst):
-                    safe_copy(src_path, dst_path, log_callback, update_progress, metrics)
-            else:
-                safe_remove(existing_dst, log_callback, metrics)
-                safe_copy(src_path, dst_path, log_callback, update_progress, metrics)
-
-    if should_delete:
-        for name, dst_path in dst_items.items():
-            if name not in src_items:
-                safe_remove(dst_path, log_callback, metrics)
-
-def safe_copy(src: Path, dst: Path, log_callback, update_progress, metrics):
+            # Обход завершён полностью — размер источника годится для следующей проверки места
+            task.last_source_bytes = metrics.total_bytes
+            walk_complete = True
+
+        if on_scan_progress:
+            on_scan_progress(metrics.total_files, True)
+
+    # Отметка синхронизации — только если весь прогон прошёл без ошибок: иначе файл,
+    # который не удалось скопировать, следующий прогон мог бы не сверить
+    if walk_complete and not metrics.errors:
+        task.last_sync_ns = run_started_ns
+
+    # Скопированные в этом прогоне файлы попадут в индекс при следующей сверке
+    if index_rows is not None:
+        try:
+            index.replace(root_src, root_dst, verified)
+        except Exception as e:
+            log_callback(f"⚠️ Не удалось сохранить индекс файлов: {e}")
+
+def safe_copy(src: str, dst: str, log_callback, update_progress, metrics):
     try:
-        dst.parent.mkdir(parents=True, exist_ok=True)
-        if src.is_dir():
-            # Используем shutil.copytree с dirs_exist_ok=True
-            shutil.copytree(src, dst, dirs_exist_ok=True)
-        else:
-            shutil.copy2(src, dst)
-            metrics.copied_files += 1
-            update_progress()
+        fast_copy2(src, dst)
+        metrics.add_copied()
+        update_progress(src)
         log_callback(f"Скопировано: {src} → {dst}")
     except Exception as e:
         log_callback(f"⚠️ Ошибка копирования {src} → {dst}: {e}")
-        metrics.errors += 1
+        metrics.add_error()
+
+def safe_link(src: str, prev: str, dst: str, log_callback, update_progress, metrics):
+    # Файл не менялся с прошлого снимка — жёсткая ссылка вместо копии (CreateHardLinkW на Windows)
+    try:
+        os.link(prev, dst)
+    except OSError:
+        # Другой том или ФС без жёстких ссылок (FAT, часть сетевых дисков)
+        safe_copy(src, dst, log_callback, update_progress, metrics)
+        return
+    metrics.add_linked()
+    update_progress(src)
+    log_callback(f"Связано: {prev} → {dst}")
+
+def _entry_size(entry: os.DirEntry) -> int:
+    try:
+        return entry.stat().st_size
+    except OSError:
+        # Например, битая символическая ссылка — её ошибку покажет копирование
+        return 0
+
+def _nested_rel_path(root: str, path: str):
+    # Относительный путь (в виде "a/b", после normcase) для path внутри root, иначе None
+    root = os.path.normcase(os.path.abspath(root))
+    path = os.path.normcase(os.path.abspath(path))
+    # Разные диски Windows: commonpath() на таких путях бросает ValueError
+    if os.path.splitdrive(root)[0] != os.path.splitdrive(path)[0]:
+        return None
+    if os.path.commonpath([root, path]) != root or root == path:
+        return None
+    return os.path.normcase(os.path.relpath(path, root).replace(os.sep, "/"))
+
+def find_latest_snapshot(root: str):
+    try:
+        with os.scandir(root) as it:
+            names = [e.name for e in it if e.is_dir(follow_symlinks=False) and SNAPSHOT_NAME_RE.match(e.name)]
+    except OSError:
+        return None
+    return os.path.join(root, max(names)) if names else None
 
-def safe_remove(path: Path, log_callback, metrics):
+def safe_remove(path: str, log_callback, metrics):
     try:
-        if path.is_dir():
+        if os.path.isdir(path) and not os.path.islink(path):
             shutil.rmtree(path)
         else:
-            path.unlink()
+            os.unlink(path)
         log_callback(f"Удалено: {path}")
     except Exception as e:
         log_callback(f"⚠️ Не удалось удалить {path}: {e}")
-        metrics.errors += 1
\ No newline at end of file
+        metrics.add_error()
@@ -1,20 +1,41 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog, scrolledtext
 from pathlib import Path
+import re
 import threading
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from servatio.config.config_manager import ConfigManager
-from servatio.core.sync_logic import sync_recursive
+from servatio.core.sync_logic import sync_tree
 from servatio.utils.metrics import BackupMetrics
-from servatio.utils.helpers import setup_logging, validate_paths, get_folder_size, get_free_space, get_total_files
+from servatio.utils.index import FileIndex
+from servatio.utils.helpers import setup_logging, stop_logging, validate_paths, get_device_id
 import os
 
+# === Связь рабочих потоков с окном ===
+# Рабочие потоки не трогают Tk: строки лога и вызовы для окна ставятся в очереди,
+# которые главный поток разбирает по таймеру
+UI_POLL_INTERVAL_MS = 100
+LOG_FLUSH_BATCH = 500
+LOG_MAX_LINES = 5000
+# Период перерисовки прогресса (10 раз в секунду)
+PROGRESS_REFRESH_MS = 100
+# Символы, недопустимые в имени файла лога (буквы любого алфавита, цифры, " ", "_" и "-" — можно)
+_UNSAFE_FILENAME_RE = re.compile(r"[^\w \-]")
+# Сколько задач с назначением на разных томах выполняются одновременно
+MAX_PARALLEL_TASKS = 4
+# Задержка сохранения конфига: серия правок подряд записывается один раз
+CONFIG_SAVE_DELAY_MS = 500
+
 # === Глобальные переменные ===
 progress_info = {
     "total_files": 0,
+    "scanning": False,
     "processed_files": 0,
     "current_file": "",
+    "found": {},
+    "scanning_tasks": set(),
     "lock": threading.Lock()
 }
 
@@ -26,16 +47,26 @@ class ServatioApp:
         self.root.minsize(900, 600)
 
         self.log_dir = Path.home() / "Documents" / "Servatio" / "Logs"
-        self.config_path = self.log_dir / "servatio_config.ini"
+        self.config_path = self.log_dir / "servatio_config.json"
         self.config_manager = ConfigManager(self.config_path)
+        self.file_index = FileIndex(self.config_path.parent / "servatio_index.db")
         self.tasks = self.config_manager.load()
         self.current_task = None
         self.logger = None
         self.current_log_file = None
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        # Потоки пула создаются по мере надобности: один на каждый том назначения в запуске
+        self.executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TASKS)
+        # Строки лога из рабочих потоков; в виджет их переносит главный поток Tk
+        self._log_queue = deque()
+        self._ui_calls = deque()
+        self._progress_running = False
+        self._config_save_id = None
+        self._running_buckets = 0
+        self._closing = False
 
         self.create_widgets()
         self.update_task_list()
+        self.root.after(UI_POLL_INTERVAL_MS, self._poll_worker_events)
 
     def create_widgets(self):
         # Меню
@@ -43,6 +74,7 @@ class ServatioApp:
         self.root.config(menu=menubar)
         settings_menu = tk.Menu(menubar, tearoff=0)
         settings_menu.add_command(label="Папка для логов...", command=self.open_settings)
+        settings_menu.add_command(label="Сбросить индекс файлов", command=self.reset_file_index)
         menubar.add_cascade(label="Настройки", menu=settings_menu)
 
         # Левая панель
@@ -114,7 +146,24 @@ class ServatioApp:
         if path:
             self.log_dir = Path(path)
             self.config_manager.log_dir = self.log_dir
-            self.config_manager.save(self.tasks)
+            self.schedule_config_save()
+
+    def schedule_config_save(self):
+        if self._config_save_id is not None:
+            self.root.after_cancel(self._config_save_id)
+        self._config_save_id = self.root.after(CONFIG_SAVE_DELAY_MS, self._flush_config)
+
+    def _flush_config(self):
+        self._config_save_id = None
+        self.config_manager.save(self.tasks)
+
+    def reset_file_index(self):
+        # Следующий запуск каждой задачи заново сверит все файлы с назначением
+        if messagebox.askyesno("Подтверждение", "Сбросить индекс? Следующие запуски сверят все файлы заново."):
+            try:
+                self.file_index.clear()
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось сбросить индекс:\n{e}")
 
     def update_task_list(self):
         self.task_listbox.delete(0, tk.END)
@@ -137,7 +186,8 @@ class ServatioApp:
             self.task_title.config(text=self.current_task.name)
             self.src_label.config(text=str(self.current_task.source))
             self.dst_label.config(text=str(self.current_task.destination))
-            self.run_btn.config(state="normal")
+            if not self._running_buckets:
+                self.run_btn.config(state="normal")
         else:
             self.clear_task_details()
 
@@ -148,7 +198,7 @@ class ServatioApp:
         if dialog.result:
             self.tasks.append(dialog.result)
             self.update_task_list()
-            self.config_manager.save(self.tasks)
+            self.schedule_config_save()
 
     def edit_task(self):
         selection = self.task_listbox.curselection()
@@ -162,8 +212,10 @@ class ServatioApp:
         self.root.wait_window(dialog.top)
         if dialog.result:
             self.tasks[idx] = dialog.result
+            if (dialog.result.source, dialog.result.destination) != (original_task.source, original_task.destination):
+                self._forget_index(original_task)
             self.update_task_list()
-            self.config_manager.save(self.tasks)
+            self.schedule_config_save()
             if self.current_task and self.current_task.name == dialog.result.name:
                 self.on_task_select(None)
 
@@ -175,9 +227,19 @@ class ServatioApp:
         idx = selection[0]
         task_name = self.tasks[idx].name
         if messagebox.askyesno("Подтверждение", f"Удалить задачу '{task_name}'?"):
-            del self.tasks[idx]
+            removed = self.tasks.pop(idx)
+            self._forget_index(removed)
             self.update_task_list()
-            self.config_manager.save(self.tasks)
+            self.schedule_config_save()
+
+    def _forget_index(self, task):
+        # Записи индекса общие для задач с теми же путями — удаляем, только если таких не осталось
+        if any((t.source, t.destination) == (task.source, task.destination) for t in self.tasks):
+            return
+        try:
+            self.file_index.forget(task.source, task.destination)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось очистить индекс задачи:\n{e}")
 
     def clear_log(self):
         self.log_text.config(state="normal")
@@ -185,93 +247,210 @@ class ServatioApp:
         self.log_text.config(state="disabled")
 
     def log_message(self, msg):
-        self.log_text.config(state="normal")
-        self.log_text.insert(tk.END, msg + "\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state="disabled")
-        self.root.update_idletasks()
+        # Вызывается из рабочих потоков: только ставим строку в очередь
+        self._log_queue.append(msg)
+
+    def _flush_log(self):
+        lines = []
+        while self._log_queue and len(lines) < LOG_FLUSH_BATCH:
+            lines.append(self._log_queue.popleft())
+        if lines:
+            self.log_text.config(state="normal")
+            self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+            # Ограничиваем размер виджета, чтобы длинный лог не тормозил Tk
+            excess = int(self.log_text.index("end-1c").split(".")[0]) - LOG_MAX_LINES
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.see(tk.END)
+            self.log_text.config(state="disabled")
+
+    def call_in_ui(self, func):
+        # Безопасно из любого потока: func выполнится в главном потоке Tk
+        self._ui_calls.append(func)
+
+    def _poll_worker_events(self):
+        # Ошибка в одном вызове не должна останавливать опрос
+        try:
+            self._flush_log()
+            while self._ui_calls:
+                self._ui_calls.popleft()()
+        finally:
+            self.root.after(UI_POLL_INTERVAL_MS, self._poll_worker_events)
+
+    def update_progress(self, current_path):
+        # Вызывается из рабочих потоков: только счётчики, перерисовка — в _refresh_progress.
+        # Блокировка защищает только счётчики, имя файла присваивается атомарно
+        progress_info["current_file"] = str(current_path)
+        with progress_info["lock"]:
+            progress_info["processed_files"] += 1
+
+    def update_scan_progress(self, found, finished, key=0):
+        # key — номер задачи в запуске: при параллельных задачах найденное суммируется
+        with progress_info["lock"]:
+            progress_info["found"][key] = found
+            progress_info["total_files"] = sum(progress_info["found"].values())
+            if finished:
+                progress_info["scanning_tasks"].discard(key)
+            progress_info["scanning"] = bool(progress_info["scanning_tasks"])
 
-    def update_progress(self):
+    def _end_scan(self, key):
+        with progress_info["lock"]:
+            progress_info["scanning_tasks"].discard(key)
+            progress_info["scanning"] = bool(progress_info["scanning_tasks"])
+
+    def _refresh_progress(self):
+        if not self._progress_running:
+            return
         with progress_info["lock"]:
             total = progress_info["total_files"]
             done = progress_info["processed_files"]
-            current = progress_info["current_file"]
-        if total > 0:
+            scanning = progress_info["scanning"]
+        current = progress_info["current_file"]
+        if scanning:
+            self.progress_label.config(text=f"Подсчёт файлов... найдено: {total}, обработано: {done}")
+        elif total > 0:
             percent = (done / total) * 100
             self.progress_var.set(percent)
             self.progress_label.config(text=f"Обработано: {done}/{total} — {current}")
         else:
             self.progress_label.config(text="Подсчёт файлов...")
+        self.root.after(PROGRESS_REFRESH_MS, self._refresh_progress)
+
+    def confirm_low_space(self, planned, free):
+        # Вызывается из рабочего потока: спрашиваем в потоке Tk и ждём ответа
+        answer = {"continue": False}
+        answered = threading.Event()
+
+        def ask():
+            try:
+                if not self._closing:
+                    answer["continue"] = messagebox.askyesno(
+                        "Недостаточно места",
+                        f"Нужно скопировать: {planned / (1024 ** 3):.2f} ГБ\nСвободно: {free / (1024 ** 3):.2f} ГБ\nПродолжить?"
+                    )
+            finally:
+                answered.set()
+
+        self.call_in_ui(ask)
+        # Окно закрывается: главный поток ждёт завершения задач и вопрос уже не покажет
+        while not answered.wait(UI_POLL_INTERVAL_MS / 1000):
+            if self._closing:
+                return False
+        return answer["continue"]
 
     def run_task(self):
         if not self.current_task:
             return
+        self._start_tasks([self.current_task], self.current_task.name)
 
-        src_path = self.current_task.source.resolve()
-        dst_path = self.current_task.destination.resolve()
-
-        try:
-            validate_paths(src_path, dst_path)
-        except ValueError as e:
-            messagebox.showerror("Ошибка валидации", str(e))
+    def run_all_tasks(self):
+        if not self.tasks:
+            messagebox.showwarning("Внимание", "Нет задач для запуска!")
             return
+        self._start_tasks(list(self.tasks), "Все задачи")
 
-        src_size = get_folder_size(src_path)
-        free_space = get_free_space(dst_path)
-        if src_size > free_space:
-            if not messagebox.askyesno(
-                    "Недостаточно места",
-                    f"Размер: {src_size / (1024 ** 3):.2f} ГБ\nСвободно: {free_space / (1024 ** 3):.2f} ГБ\nПродолжить?"
-            ):
+    def _start_tasks(self, tasks, log_name):
+        if self._running_buckets:
+            return
+        for task in tasks:
+            try:
+                # resolve() только для назначения: проверке корня диска нужен настоящий путь
+                validate_paths(task.source, task.destination.resolve())
+            except ValueError as e:
+                messagebox.showerror("Ошибка валидации", f"{task.name}: {e}")
                 return
 
         # Создаём папку логов и файл
         self.log_dir.mkdir(parents=True, exist_ok=True)
-        safe_name = "".join(c if c.isalnum() or c in " _-" else "_" for c in self.current_task.name)
+        safe_name = _UNSAFE_FILENAME_RE.sub("_", log_name)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         self.current_log_file = self.log_dir / f"{safe_name}_{timestamp}.log"
 
         global progress_info
         progress_info = {
-            "total_files": get_total_files(src_path, self.current_task.exclude_patterns),
+            "total_files": 0,
+            "scanning": True,
             "processed_files": 0,
             "current_file": "",
+            "found": {},
+            "scanning_tasks": set(range(len(tasks))),
             "lock": threading.Lock()
         }
 
         self.run_btn.config(state="disabled", text="⏳ Выполняется...")
+        self.run_all_btn.config(state="disabled")
         self.open_log_btn.config(state="normal")  # <-- Включаем кнопку
+        self._progress_running = True
+        self._refresh_progress()
 
         self.logger = setup_logging(self.current_log_file)
-        self.logger.info(f"Запуск задачи: {self.current_task.name}")
+
+        # Задачи с назначением на одном томе идут по очереди (параллельная запись на один диск
+        # только мешает), на разных томах — одновременно
+        buckets = {}
+        for key, task in enumerate(tasks):
+            buckets.setdefault(get_device_id(task.destination), []).append((key, task))
+        self._running_buckets = len(buckets)
+        tag_lines = len(tasks) > 1
+
+        def bucket_runner(bucket):
+            for key, task in bucket:
+                try:
+                    self._run_one_task(task, key, tag_lines)
+                except Exception as e:
+                    self.log_message(f"❌ Ошибка задачи {task.name}: {e}")
+                    self.logger.exception(f"Ошибка задачи {task.name}")
+                finally:
+                    # Задача без источника или с ошибкой не сообщает о конце подсчёта сама
+                    self._end_scan(key)
+            self.call_in_ui(self._on_bucket_done)
+
+        for bucket in buckets.values():
+            self.executor.submit(bucket_runner, bucket)
+
+    def _run_one_task(self, task, key, tag_lines):
+        # Выполняется в потоке пула задач
+        self.logger.info(f"Запуск задачи: {task.name}")
+        prefix = f"[{task.name}] " if tag_lines else ""
 
         def gui_logger(msg):
+            msg = prefix + msg
             self.log_message(msg)
             self.logger.info(msg)
 
-        def task_runner():
-            metrics = BackupMetrics()
-            metrics.start()
-            metrics.total_files = progress_info["total_files"]
+        def on_scan_progress(found, finished):
+            self.update_scan_progress(found, finished, key)
 
-            sync_recursive(self.current_task, metrics, gui_logger, self.update_progress, self.current_task.delete_extra)
+        metrics = BackupMetrics()
+        metrics.start()
 
-            metrics.finish()
-            duration = metrics.duration()
-            self.logger.info(f"Задача завершена за {duration}. Ошибок: {metrics.errors}")
-            self.root.after(0, self.on_task_complete)
+        sync_tree(task, metrics, gui_logger, self.update_progress, task.delete_extra,
+                  excludes=task.excludes, on_scan_progress=on_scan_progress,
+                  on_low_space=self.confirm_low_space,
+                  index=self.file_index if task.use_index else None)
 
-        self.executor.submit(task_runner)
+        metrics.finish()
+        duration = metrics.duration()
+        self.logger.info(
+            f"{prefix}Задача завершена за {duration}. Файлов в источнике: {metrics.total_files} "
+            f"({metrics.total_bytes / (1024 ** 3):.2f} ГБ), скопировано: {metrics.copied_files}, "
+            f"связано: {metrics.linked_files}, ошибок: {metrics.errors}"
+        )
+
+    def _on_bucket_done(self):
+        self._running_buckets -= 1
+        if self._running_buckets == 0:
+            self.on_task_complete()
 
     def on_task_complete(self):
-        self.run_btn.config(state="normal", text="▶️ Запустить задачу")
+        self._progress_running = False
+        stop_logging()
+        self.schedule_config_save()
+        self.run_btn.config(state="normal" if self.current_task else "disabled", text="▶️ Запустить задачу")
+        self.run_all_btn.config(state="normal")
         self.progress_var.set(0)
         self.progress_label.config(text="Готово.")
 
-    def run_all_tasks(self):
-        # Аналогично, но с циклом по всем задачам
-        pass
-
     def open_log_file(self):
         if hasattr(self, 'current_log_file') and self.current_log_file and self.current_log_file.exists():
             try:
@@ -282,6 +461,12 @@ class ServatioApp:
             messagebox.showwarning("Внимание", "Лог-файл не найден.")
 
     def on_closing(self):
-        self.config_manager.save(self.tasks)
+        self._closing = True
         self.executor.shutdown(wait=True)
+        if self._config_save_id is not None:
+            self.root.after_cancel(self._config_save_id)
+        self._flush_config()
+        # Задача могла завершиться уже после последнего опроса очереди вызовов —
+        # дописываем её лог здесь
+        stop_logging()
         self.root.destroy()
\ No newline at end of file
@@ -1,13 +1,13 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from servatio.core.backup_task import DEFAULT_EXCLUDE_PATTERNS
+from servatio.core.backup_task import DEFAULT_EXCLUDE_PATTERNS, DEFAULT_COPY_WORKERS
 
 class TaskDialog:
     def __init__(self, parent, task=None):
         self.result = None
         self.top = tk.Toplevel(parent)
         self.top.title("Редактировать задачу" if task else "Новая задача")
-        self.top.geometry("600x500")
+        self.top.geometry("600x650")
         self.top.transient(parent)
         self.top.grab_set()
 
@@ -37,6 +37,31 @@ class TaskDialog:
             text="Удалять лишние файлы в целевой папке",
             variable=self.delete_var
         ).pack(anchor="w")
+        self.fast_skip_var = tk.BooleanVar(value=task.fast_dir_skip if task else False)
+        ttk.Checkbutton(
+            options_frame,
+            text="Не сверять старые файлы в неизменившихся папках (без удаления лишних;\n"
+                 "правку файла с подменой даты изменения на более раннюю не заметит)",
+            variable=self.fast_skip_var
+        ).pack(anchor="w")
+        self.snapshot_var = tk.BooleanVar(value=task.snapshot_mode if task else False)
+        ttk.Checkbutton(
+            options_frame,
+            text="Снимки: каждый запуск в новую папку, неизменённые файлы — жёсткие ссылки",
+            variable=self.snapshot_var
+        ).pack(anchor="w")
+        self.index_var = tk.BooleanVar(value=task.use_index if task else False)
+        ttk.Checkbutton(
+            options_frame,
+            text="Индекс файлов: не сверять назначение, если файл в источнике не менялся",
+            variable=self.index_var
+        ).pack(anchor="w")
+
+        workers_frame = ttk.Frame(options_frame)
+        workers_frame.pack(anchor="w", pady=(5, 0))
+        ttk.Label(workers_frame, text="Потоков копирования:").pack(side="left")
+        self.workers_var = tk.StringVar(value=str(task.max_workers if task else DEFAULT_COPY_WORKERS))
+        ttk.Spinbox(workers_frame, from_=1, to=32, width=5, textvariable=self.workers_var).pack(side="left", padx=(5, 0))
 
         ttk.Label(options_frame, text="Исключения (по одному на строку):").pack(anchor="w", pady=(10, 5))
         self.exclude_text = tk.Text(options_frame, height=6, wrap=tk.WORD)
@@ -67,6 +92,14 @@ class TaskDialog:
             messagebox.showerror("Ошибка", "Заполните все поля!")
             return
 
+        try:
+            max_workers = int(self.workers_var.get())
+        except ValueError:
+            max_workers = 0
+        if not 1 <= max_workers <= 32:
+            messagebox.showerror("Ошибка", "Число потоков должно быть от 1 до 32!")
+            return
+
         exclude_content = self.exclude_text.get("1.0", tk.END).strip()
         exclude_patterns = [line.strip() for line in exclude_content.splitlines() if line.strip()]
 
@@ -76,7 +109,11 @@ class TaskDialog:
             source=src,
             destination=dst,
             exclude_patterns=exclude_patterns,
-            delete_extra=self.delete_var.get()
+            delete_extra=self.delete_var.get(),
+            fast_dir_skip=self.fast_skip_var.get(),
+            snapshot_mode=self.snapshot_var.get(),
+            max_workers=max_workers,
+            use_index=self.index_var.get()
         )
         self.top.destroy()
 
@@ -0,0 +1,94 @@
+import os
+import sys
+import errno
+import shutil
+import ctypes
+import ctypes.util
+
+# Буфер для копирования через read/write (у shutil по умолчанию 64 КБ на Windows, 1 МБ на POSIX)
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+shutil.COPY_BUFSIZE = COPY_BUFFER_SIZE
+
+# Ошибки, при которых ядро не умеет копировать данную пару файлов
+_NATIVE_COPY_UNSUPPORTED = {errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF}
+
+def fast_copy2(src: str, dst: str):
+    # Копирование средствами ОС без буфера в Python; при отказе — read/write блоками по 4 МБ.
+    # Время изменения и права переносятся один раз в конце, как в shutil.copy2
+    if os.name == 'nt':
+        # CopyFile2/CopyFileExW сами сохраняют атрибуты и время изменения
+        if _win_copy_file(src, dst):
+            return
+        _copy_fileobj(src, dst)
+    elif sys.platform == "darwin":
+        # Клон APFS; если не вышел — fcopyfile внутри shutil.copyfile
+        if not _clone_file(src, dst):
+            shutil.copyfile(src, dst)
+    elif sys.platform.startswith("linux"):
+        try:
+            _copy_file_range(src, dst)
+        except OSError as e:
+            if e.errno not in _NATIVE_COPY_UNSUPPORTED:
+                raise
+            _copy_fileobj(src, dst)
+    else:
+        _copy_fileobj(src, dst)
+    shutil.copystat(src, dst)
+
+def _copy_fileobj(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+
+def _win_copy_file(src: str, dst: str) -> bool:
+    # CopyFile2 (Windows 8+) копирует на стороне ядра, умеет блочное клонирование на ReFS
+    # и серверное копирование по SMB; обе функции сохраняют атрибуты и время изменения
+    kernel32 = ctypes.windll.kernel32
+    copy_file2 = getattr(kernel32, "CopyFile2", None)
+    if copy_file2 is not None:
+        copy_file2.restype = ctypes.c_long  # HRESULT, 0 — успех
+        return copy_file2(src, dst, None) == 0
+    return bool(kernel32.CopyFileExW(src, dst, None, None, None, 0))
+
+_libc = None
+
+def _clone_file(src: str, dst: str) -> bool:
+    # clonefile(2) создаёт копию-клон на том же томе APFS без копирования данных.
+    # Существующий файл клон не перезаписывает — такие файлы копируются обычным путём
+    global _libc
+    if os.path.lexists(dst):
+        return False
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    clonefile = getattr(_libc, "clonefile", None)
+    if clonefile is None:
+        return False
+    return clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+
+def _copy_file_range(src: str, dst: str):
+    chunk = 1 << 30
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        mode = os.fstat(src_fd).st_mode & 0o777
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            copied = 0
+            use_copy_range = hasattr(os, "copy_file_range")
+            while True:
+                if use_copy_range:
+                    try:
+                        sent = os.copy_file_range(src_fd, dst_fd, chunk)
+                    except OSError as e:
+                        if e.errno not in _NATIVE_COPY_UNSUPPORTED:
+                            raise
+                        # Например, разные ФС на старом ядре — продолжаем через sendfile
+                        use_copy_range = False
+                        continue
+                else:
+                    sent = os.sendfile(dst_fd, src_fd, copied, chunk)
+                if sent == 0:
+                    break
+                copied += sent
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
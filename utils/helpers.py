@@ -1,5 +1,8 @@
 import os
+import re
+import string
 import ctypes
+from functools import lru_cache
 from pathlib import Path
 import fnmatch
 
@@ -11,68 +14,139 @@ def enable_long_paths():
         except Exception:
             pass
 
-def is_excluded(path: Path, exclude_patterns, base_path: Path):
-    try:
-        rel_path = path.relative_to(base_path).as_posix()
-    except ValueError:
-        return False
-    for pattern in exclude_patterns:
-        if fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(rel_path, f"**/{pattern}"):
+_GLOB_CHARS = frozenset("*?[")
+# Перевод glob→regex кэшируется по отдельному шаблону: у разных задач списки
+# исключений отличаются, но сами шаблоны в основном общие
+_translate = lru_cache(maxsize=512)(fnmatch.translate)
+
+@lru_cache(maxsize=64)
+def _compile_excludes(patterns: tuple):
+    # Шаблон без "/" сравнивается с именем элемента на любой глубине, шаблон с "/" —
+    # с относительным путём целиком или как "**/шаблон". Исключённый каталог не обходится.
+    # Простые шаблоны разбираются на дешёвые строковые проверки, regex — только для остальных
+    case_fold = os.name == 'nt'  # fnmatch на Windows сравнивает без учёта регистра
+    names = set()       # ".git", "Thumbs.db" — имя последнего элемента пути
+    paths = []          # "a/b" — конец пути целиком
+    suffixes = []       # "*.tmp"
+    prefixes = []       # "build*"
+    name_globs = []     # "f?o", "[ab].txt" — прочие шаблоны без "/", по имени элемента
+    path_globs = []     # "docs/*.md" — прочие шаблоны с "/", по пути целиком
+    for pattern in patterns:
+        if case_fold:
+            pattern = pattern.lower()
+        if not _GLOB_CHARS.intersection(pattern):
+            if "/" in pattern:
+                paths.append(pattern)
+            else:
+                names.add(pattern)
+        elif pattern.startswith("*") and not _GLOB_CHARS.intersection(pattern[1:]):
+            suffixes.append(pattern[1:])
+        elif pattern.endswith("*") and not _GLOB_CHARS.intersection(pattern[:-1]):
+            prefixes.append(pattern[:-1])
+        elif "/" not in pattern:
+            name_globs.append(_translate(pattern))
+        else:
+            # Необязательный префикс каталогов вместо второго шаблона "**/шаблон"
+            path_globs.append("(?:.*/)?" + _translate(pattern))
+
+    names = frozenset(names)
+    paths = tuple(paths)
+    path_tails = tuple("/" + p for p in paths)
+    suffixes = tuple(suffixes)
+    prefixes = tuple(prefixes)
+    inner_prefixes = tuple("/" + p for p in prefixes)
+    name_regex = re.compile("|".join(f"(?:{part})" for part in name_globs)) if name_globs else None
+    path_regex = re.compile("|".join(f"(?:{part})" for part in path_globs)) if path_globs else None
+
+    def excluded(rel_path: str) -> bool:
+        if case_fold:
+            rel_path = rel_path.lower()
+        name = rel_path.rpartition("/")[2]
+        if names and name in names:
             return True
-    return False
+        if suffixes and rel_path.endswith(suffixes):
+            return True
+        if paths and (rel_path in paths or rel_path.endswith(path_tails)):
+            return True
+        if prefixes and (rel_path.startswith(prefixes) or any(p in rel_path for p in inner_prefixes)):
+            return True
+        if name_regex is not None and name_regex.match(name) is not None:
+            return True
+        return path_regex is not None and path_regex.match(rel_path) is not None
+
+    # Все шаблоны проверяют только имя элемента: обходу не нужно собирать относительный путь
+    excluded.name_only = not (paths or path_regex is not None
+                              or any("/" in p for p in suffixes + prefixes))
+    return excluded
 
-def files_are_equal(file1: Path, file2: Path) -> bool:
-    if not file2.exists():
+def compile_excludes(exclude_patterns):
+    return _compile_excludes(tuple(exclude_patterns))
+
+# Допуск по времени изменения: меньше секунды (ФС и сетевые ресурсы с секундной точностью)
+MTIME_TOLERANCE_NS = 1_000_000_000
+# FAT/exFAT хранят время с точностью до 2 секунд
+FAT_MTIME_STEP_NS = 2_000_000_000
+
+def files_are_equal(stat1: os.stat_result, stat2: os.stat_result) -> bool:
+    # stat1 — источник, stat2 — копия. Сравнение целых наносекунд, без float
+    if stat1.st_size != stat2.st_size:
         return False
-    stat1 = file1.stat()
-    stat2 = file2.stat()
-    return stat1.st_size == stat2.st_size and abs(stat1.st_mtime - stat2.st_mtime) < 1
+    delta = abs(stat1.st_mtime_ns - stat2.st_mtime_ns)
+    if delta < MTIME_TOLERANCE_NS:
+        return True
+    # Время копии на целой чётной секунде — похоже на FAT, допускаем её округление
+    return stat2.st_mtime_ns % FAT_MTIME_STEP_NS == 0 and delta < FAT_MTIME_STEP_NS
+
+# Корни дисков Windows (после отбрасывания завершающего разделителя)
+_DANGEROUS_ROOTS = frozenset(f"{d}:" for d in string.ascii_uppercase)
 
 def validate_paths(src: Path, dst: Path):
     if not src.is_absolute() or not dst.is_absolute():
         raise ValueError("Пути должны быть абсолютными!")
-    if src.resolve() == dst.resolve():
+    # Пути уже абсолютные: достаточно нормализации строк, без обхода ФС как в resolve()
+    if os.path.normcase(os.path.normpath(str(src))) == os.path.normcase(os.path.normpath(str(dst))):
         raise ValueError("Исходный и целевой каталоги совпадают!")
-    dangerous = [f"{d}:\\" for d in "CDEFGHIJKLMNOPQRSTUVWXYZ"]
-    dst_clean = str(dst).rstrip("\\/").upper()
-    if dst_clean in [d.upper() for d in dangerous]:
+    if str(dst).rstrip("\\/").upper() in _DANGEROUS_ROOTS:
         raise ValueError("Запрещено синхронизировать в корень диска!")
 
-def get_total_files(src: Path, exclude_patterns):
-    count = 0
+def _existing_parent(path) -> str:
+    # Назначение может быть ещё не создано — берём ближайший существующий родитель
+    path = str(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def get_device_id(path):
+    # Ключ физического тома: буква диска (или UNC-ресурс) на Windows, st_dev на POSIX
+    if os.name == 'nt':
+        return os.path.splitdrive(os.path.abspath(str(path)))[0].upper()
     try:
-        for item in src.rglob("*"):
-            if item.is_file() and not is_excluded(item, exclude_patterns, src):
-                count += 1
-    except PermissionError:
-        pass
+        return os.stat(_existing_parent(path)).st_dev
     except OSError:
-        # Игнорируем ошибки с именами файлов/длинными путями
-        pass
-    return count
+        return None
 
 def get_free_space(path: Path):
+    path = _existing_parent(path)
     if os.name == 'nt':
         free_bytes = ctypes.c_ulonglong(0)
-        ctypes.windll.kernel32.GetDiskFreeSpaceExW(str(path), None, None, ctypes.byref(free_bytes))
+        ctypes.windll.kernel32.GetDiskFreeSpaceExW(path, None, None, ctypes.byref(free_bytes))
         return free_bytes.value
     else:
         statvfs = os.statvfs(path)
         return statvfs.f_frsize * statvfs.f_bavail
 
-def get_folder_size(path: Path):
-    total = 0
-    try:
-        for entry in path.glob("**/*"):
-            if entry.is_file():
-                total += entry.stat().st_size
-    except (OSError, PermissionError):
-        pass
-    return total
+_log_listener = None
 
 def setup_logging(log_file, level=20):  # 20 = INFO
     import logging
-    from logging.handlers import RotatingFileHandler
+    import queue
+    from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+    global _log_listener
+
+    stop_logging()
 
     logger = logging.getLogger("Servatio")
     logger.setLevel(level)
@@ -84,10 +158,24 @@ def setup_logging(log_file, level=20):  # 20 = INFO
 
     file_handler = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
     console_handler = logging.StreamHandler()
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
 
-    return logger
\ No newline at end of file
+    # Рабочие потоки только кладут записи в очередь, запись на диск — в потоке слушателя
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, file_handler, console_handler)
+    _log_listener.start()
+
+    return logger
+
+def stop_logging():
+    # Дописывает очередь и закрывает файл лога
+    global _log_listener
+    if _log_listener is None:
+        return
+    _log_listener.stop()
+    for handler in _log_listener.handlers:
+        handler.close()
+    _log_listener = None
\ No newline at end of file
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, Tuple
+
+# Индекс файлов: для каждой пары источник → назначение — размер и mtime (нс) источника
+# на момент, когда файл в назначении был сверен с ним. Если источник с тех пор не менялся,
+# назначение не проверяется вовсе (как локальный кэш метаданных у restic).
+# Ключ — сами пути, а не имя задачи: после смены путей в задаче старые записи не подходят
+
+class FileIndex:
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+
+    def _connect(self):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.db_path))
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "source TEXT NOT NULL, destination TEXT NOT NULL, rel TEXT NOT NULL, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+            "PRIMARY KEY (source, destination, rel))"
+        )
+        return conn
+
+    @staticmethod
+    def _key(source, destination) -> Tuple[str, str]:
+        return (os.path.normcase(os.path.abspath(str(source))),
+                os.path.normcase(os.path.abspath(str(destination))))
+
+    def load(self, source, destination) -> Dict[str, Tuple[int, int]]:
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT rel, size, mtime_ns FROM entries WHERE source = ? AND destination = ?",
+                self._key(source, destination)
+            )
+            return {rel: (size, mtime_ns) for rel, size, mtime_ns in rows}
+        finally:
+            conn.close()
+
+    def replace(self, source, destination, entries: Dict[str, Tuple[int, int]]):
+        # Одна транзакция на весь прогон
+        key = self._key(source, destination)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM entries WHERE source = ? AND destination = ?", key)
+                conn.executemany(
+                    "INSERT INTO entries (source, destination, rel, size, mtime_ns) VALUES (?, ?, ?, ?, ?)",
+                    (key + (rel, size, mtime_ns) for rel, (size, mtime_ns) in entries.items())
+                )
+        finally:
+            conn.close()
+
+    def forget(self, source, destination):
+        # Задача удалена или сменила пути — её записи больше не нужны
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM entries WHERE source = ? AND destination = ?",
+                             self._key(source, destination))
+        finally:
+            conn.close()
+
+    def clear(self):
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("DELETE FROM entries")
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            # Например, база занята — это не повод удалять файл
+            raise
+        except sqlite3.DatabaseError:
+            # Файл повреждён: индекс — только кэш, удаляем его целиком
+            for suffix in ("", "-wal", "-shm"):
+                self.db_path.with_name(self.db_path.name + suffix).unlink(missing_ok=True)
@@ -1,12 +1,28 @@
 from datetime import datetime
+import threading
 
 class BackupMetrics:
     def __init__(self):
         self.start_time = None
         self.end_time = None
         self.total_files = 0
+        self.total_bytes = 0
         self.copied_files = 0
+        self.linked_files = 0
         self.errors = 0
+        self._lock = threading.Lock()
+
+    def add_copied(self):
+        with self._lock:
+            self.copied_files += 1
+
+    def add_linked(self):
+        with self._lock:
+            self.linked_files += 1
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
 
     def start(self):
         self.start_time = datetime.now()